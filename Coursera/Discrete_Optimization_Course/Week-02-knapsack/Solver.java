@@ -30,6 +30,10 @@ public class Solver {
             if(arg.startsWith("-file=")){
                 fileName = arg.substring(6);
             } 
+            if(arg.equals("-worker")){
+                serve(System.in, System.out);
+                return;
+            }
         }
         if(fileName == null)
             return;
@@ -48,7 +52,43 @@ public class Solver {
             input.close();
         }
         
-        
+        System.out.println(solveInstance(lines));
+    }
+
+    /**
+     * Answer instances until the input is closed. Each request and each response
+     * is a 4 bytes big-endian length followed by that many bytes of UTF-8 text.
+     */
+    public static void serve(InputStream in, OutputStream out) throws IOException {
+        DataInputStream input = new DataInputStream(new BufferedInputStream(in));
+        DataOutputStream output = new DataOutputStream(new BufferedOutputStream(out));
+
+        while(true){
+            int length;
+            try {
+                length = input.readInt();
+            } catch (EOFException e) {
+                return;
+            }
+            byte[] request = new byte[length];
+            input.readFully(request);
+
+            List<String> lines = new ArrayList<String>();
+            for(String line : new String(request, "UTF-8").split("\n")){
+                lines.add(line);
+            }
+
+            byte[] response = solveInstance(lines).getBytes("UTF-8");
+            output.writeInt(response.length);
+            output.write(response);
+            output.flush();
+        }
+    }
+
+    /**
+     * Solve the instance given by its lines and return the solution in the output format
+     */
+    public static String solveInstance(List<String> lines) {
         // parse the data in the file
         String[] firstLine = lines.get(0).split("\\s+");
         int items = Integer.parseInt(firstLine[0]);
@@ -82,10 +122,11 @@ public class Solver {
         }
         
         // prepare the solution in the specified output format
-        System.out.println(value+" 0");
+        StringBuilder solution = new StringBuilder();
+        solution.append(value+" 0\n");
         for(int i=0; i < items; i++){
-            System.out.print(taken[i]+" ");
+            solution.append(taken[i]+" ");
         }
-        System.out.println("");        
+        return solution.toString();
     }
 }
\ No newline at end of file
@@ -1,199 +1,1265 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import sys
+import time
+import bisect
+import threading
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+import numpy as np
+from queue import Queue, Empty
 from collections import namedtuple
 Item = namedtuple("Item", ['index', 'value', 'weight', 'benefit'])
+Incumbent = namedtuple("Incumbent", ['value', 'taken', 'gap', 'optimal'])
+EngineChoice = namedtuple("EngineChoice", ['name', 'seconds', 'memory', 'reason'])
+KnapsackReduction = namedtuple("KnapsackReduction", ['items', 'capacity', 'fixed', 'fixed_value',
+                                                     'incumbent_value', 'incumbent_taken'])
 
 debug = True
 
+# Memory (in bytes) and time (in seconds) an exact engine may use. When no exact
+# engine is expected to fit, the core solver runs until the time budget ends.
+MEMORY_BUDGET = 10**9
+TIME_BUDGET = 60
+
+# Rough cost (in seconds) of the unit of work of each engine: a DP cell, a bit
+# of the reachable capacities, a Pareto state or an enumerated subset.
+DP_CELL_SECONDS = 3e-9
+BITSET_CELL_SECONDS = 2e-10
+PARETO_STATE_SECONDS = 2e-7
+SUBSET_SECONDS = 1e-7
+
+# The meet in the middle is only estimated up to this amount of items; past it,
+# 2^(n/2) subsets are out of any budget (and out of the range of a float).
+MEET_IN_THE_MIDDLE_MAX_ITEMS = 60
+
+# Rough cost (in seconds) of starting a worker process. With spawn and forkserver
+# every worker starts a new interpreter and imports this module and NumPy.
+PROCESS_START_SECONDS = {'fork': 0.005, 'forkserver': 0.15, 'spawn': 0.25}
+
+# In the anytime mode, an exact engine is only run if its estimated time is at
+# most this fraction of the time left, to keep a margin for bad estimates.
+ANYTIME_SAFETY = 0.5
+
+# Maximum amount of (item, capacity) cells for solving the core with the DP
+# instead of the branch and bound.
+CORE_DP_MAX_CELLS = 10**8
+
+# Before an engine expected to take longer than CORE_TRIAL_MIN_SECONDS, the core
+# solver gets this fraction of the estimated time to prove the optimum, which it
+# often does in much less time than a DP over the whole instance.
+CORE_TRIAL_SHARE = 0.1
+CORE_TRIAL_MIN_SECONDS = 1.0
+
+class ItemStore(object):
+    """Items of a knapsack instance stored as NumPy columns."""
+
+    def __init__(self, index, value, weight):
+        self.index = np.asarray(index, dtype=np.int64)
+        self.value = np.asarray(value, dtype=np.int64)
+        self.weight = np.asarray(weight, dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.benefit = self.value / self.weight.astype(float)
+
+    @classmethod
+    def from_items(cls, items):
+        ''' Returns the store of a list of Items (or the store itself) '''
+        if isinstance(items, cls):
+            return items
+        return cls([i.index for i in items], [i.value for i in items], [i.weight for i in items])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        # An integer gives one Item; a slice, a mask or an array of positions gives a store.
+        if isinstance(key, (int, np.integer)):
+            return Item(int(self.index[key]), int(self.value[key]), int(self.weight[key]),
+                        float(self.benefit[key]))
+        return ItemStore(self.index[key], self.value[key], self.weight[key])
+
+    def __iter__(self):
+        columns = (self.index.tolist(), self.value.tolist(), self.weight.tolist(), self.benefit.tolist())
+        return (Item(*item) for item in zip(*columns))
+
+    def sorted_by_benefit(self):
+        ''' Returns the items ordered descendant by benefit '''
+        # I don't need to break equalities. It's the same for me.
+        return self[np.argsort(-self.benefit, kind='stable')]
+
+    def fitting(self, capacity):
+        ''' Returns the items that aren't heavier than the capacity '''
+        return self[self.weight <= capacity]
+
+    def taken(self, mask, amount_items):
+        ''' Returns the 0/1 taken list of the items selected by the mask '''
+        taken = np.zeros(amount_items, dtype=np.int64)
+        taken[self.index[mask]] = 1
+        return taken.tolist()
+
+
 def calculate_upperbound(items, K):
-    value = 0
-    optimal = 0
-    weight = 0
-    for i in range(len(items)):
-        if weight + items[i].weight <= K:
-            weight += items[i].weight
-            value += items[i].value
-        else:
-            space = K - weight
-            value = value + space*1.0/items[i].weight * items[i].value
-            break
+    items = ItemStore.from_items(items)
+    # The items are taken in order while they fit, and the break item fractionally.
+    weights = np.cumsum(items.weight)
+    stop = int(np.searchsorted(weights, K, side='right'))
+    value = float(items.value[:stop].sum())
+    if stop < len(items):
+        space = K - (weights[stop-1] if stop else 0)
+        value = value + space*1.0/items.weight[stop] * items.value[stop]
     return value
 
+def martello_toth_bound(items, K):
+    ''' Returns the Martello-Toth U2 bound; items must fit and be sorted by benefit '''
+    items = ItemStore.from_items(items)
+    # The items without weight are always taken, and they have no benefit to
+    # bound the others with, so the bound is over the rest.
+    weightless = items.weight == 0
+    weightless_value = int(items.value[weightless].sum())
+    items = items[~weightless]
+
+    weights = np.cumsum(items.weight)
+    brk = int(np.searchsorted(weights, K, side='right'))
+    if brk == len(items):
+        return weightless_value + int(items.value.sum())
+    value = weightless_value + int(items.value[:brk].sum())
+    space = K - (int(weights[brk-1]) if brk else 0)
+
+    # Either the break item is left out, and the room is filled at the benefit of
+    # the next item, or it is put in, and its excess weight is taken out at the
+    # benefit of the previous one.
+    without_break = value
+    if brk + 1 < len(items):
+        without_break += space * int(items.value[brk+1]) // int(items.weight[brk+1])
+    with_break = without_break
+    if brk > 0:
+        excess = int(items.weight[brk]) - space
+        with_break = value + int(np.floor(int(items.value[brk])
+                                          - excess * items.value[brk-1] / float(items.weight[brk-1])))
+    return max(without_break, with_break)
+
+
+def knapsack_upper_bound(items, capacity):
+    ''' Returns the best available bound: the LP one or the Martello-Toth U2 '''
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    return min(int(calculate_upperbound(items, capacity) + 1e-9), martello_toth_bound(items, capacity))
+
+
+class UpperBoundOracle(object):
+    """Fractional upper bound of any suffix of items sorted by benefit."""
+
+    def __init__(self, items):
+        # items must be sorted descendant by benefit.
+        self.items = ItemStore.from_items(items)
+        self.weights_array = np.concatenate(([0], np.cumsum(self.items.weight)))
+        self.values_array = np.concatenate(([0], np.cumsum(self.items.value)))
+        # Python lists are faster than arrays for one query at a time.
+        self.weights = self.weights_array.tolist()
+        self.values = self.values_array.tolist()
+        self.item_weights = self.items.weight.tolist()
+        self.item_values = self.items.value.tolist()
+
+    def bound(self, start, room):
+        ''' Returns the bound of the items from start on with the given capacity '''
+        # The break item is the first one that doesn't fit when I take them in order,
+        # so I look for it with a binary search over the prefix sums of the weights.
+        limit = self.weights[start] + room
+        stop = bisect.bisect_right(self.weights, limit, start) - 1
+        value = self.values[stop] - self.values[start]
+        if stop < len(self.items):
+            space = limit - self.weights[stop]
+            value += space*1.0/self.item_weights[stop] * self.item_values[stop]
+        return value
+
+    def bounds(self, start, rooms):
+        ''' Returns the bound of the items from start on for an array of capacities '''
+        weights, values = self.weights_array, self.values_array
+        limits = weights[start] + rooms
+        stops = np.searchsorted(weights, limits, side='right') - 1
+        result = (values[stops] - values[start]).astype(float)
+        partial = stops < len(self.items)
+        if partial.any():
+            breaks = stops[partial]
+            space = limits[partial] - weights[breaks]
+            result[partial] += space*1.0/self.items.weight[breaks] * self.items.value[breaks]
+        return result
+
+    def bounds_flipped(self, brk, capacity):
+        ''' Returns, for every item, the bound when its greedy decision is flipped '''
+        # Taking an item j before the break item out, the rest of the prefix still
+        # fits, so the bound continues from the break item with the freed room.
+        # Putting an item j from the break item on in, the bound of the others with
+        # the remaining room never reaches j, so it is the bound from the start.
+        # Items must not be heavier than the capacity.
+        weights, values = self.items.weight, self.items.value
+        result = np.empty(len(self.items))
+        result[:brk] = (self.values[brk] - values[:brk]
+                        + self.bounds(brk, capacity - self.weights[brk] + weights[:brk]))
+        result[brk:] = values[brk:] + self.bounds(0, capacity - weights[brk:])
+        return result
+
+
+def greedy_mask(weights, room):
+    ''' Returns which of the weights are taken, in order, whenever they fit '''
+    # Instead of going one by one, I take at once every run of items that fit
+    # consecutively: only the item that ends the run is skipped, and I continue after it.
+    mask = np.zeros(len(weights), dtype=bool)
+    position = 0
+    while position < len(weights):
+      candidates = position + np.flatnonzero(weights[position:] <= room)
+      if len(candidates) == 0:
+        break
+      sums = np.cumsum(weights[candidates])
+      fitting = int(np.searchsorted(sums, room, side='right'))
+      mask[candidates[:fitting]] = True
+      if fitting:
+        room -= int(sums[fitting-1])
+      if fitting == len(candidates):
+        break
+      position = candidates[fitting] + 1
+    return mask
+
+
 def fill_knapsack_greedy(items, capacity, amount_items=None):
     if amount_items is None:
       amount_items = len(items)
-    
-    # I order the values descendant by benefit
-    # I don't need to break equalities. It's the same for me.
-    value = 0
-    weight = 0
+    items = ItemStore.from_items(items)
+
+    # The items are taken in the given order whenever they fit.
     optimal = 0
-    taken = [0 for j in xrange(amount_items)]
+    mask = greedy_mask(items.weight, capacity)
 
-    for item in items:
-        if weight + item.weight <= capacity:
-            taken[item.index] = 1
-            value += item.value
-            weight += item.weight
-    
-    return value, taken, optimal
+    value = int(items.value[mask].sum())
+    return value, items.taken(mask, amount_items), optimal
 
 def fill_knapsack_heuristically(items, capacity):
+    ''' Returns the greedy solution in order of benefit, over the items that fit '''
     amount_items = len(items)
-    
-    # I order the values descendant by benefit
-    # I don't need to break equalities. It's the same for me.
-    items.sort(key=lambda item: item.benefit, reverse=True)
-    
-    # I remove elements heavier than the allowed capacity or 
-    # those which their values overpass the upper_bound:
-    upper_bound = calculate_upperbound(items, capacity)
-    items = filter(lambda i: i.weight < capacity and i.value < upper_bound, items)
-    # items = filter(lambda i: i.weight > capacity*.02 and i.weight < capacity*.98, items)
-    
-    value, taken, optimal = fill_knapsack_greedy(items, capacity, amount_items)
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    return fill_knapsack_greedy(items, capacity, amount_items)
 
-    return value, taken, optimal
+
+def fill_leftover(items, capacity, mask):
+    ''' Adds to the mask, in order, the items left out that still fit '''
+    room = capacity - int(items.weight[mask].sum())
+    left_out = np.flatnonzero(~mask)
+    mask[left_out[greedy_mask(items.weight[left_out], room)]] = True
+    return mask
+
+
+def improve_knapsack(items, capacity, mask, max_passes=1000):
+    ''' Improves a solution with the best single item, 1-1 and 2-1 swaps '''
+    # items must fit and be sorted descendant by benefit, and mask says which are taken.
+    weights, values = items.weight, items.value
+    mask = fill_leftover(items, capacity, mask.copy())
+
+    # The most valuable item alone may be better than the whole solution.
+    if len(items):
+      single = int(np.argmax(values))
+      if values[single] > values[mask].sum():
+        mask[:] = False
+        mask[single] = True
+        mask = fill_leftover(items, capacity, mask)
+
+    for _ in range(max_passes):
+      room = capacity - int(weights[mask].sum())
+      inside = np.flatnonzero(mask)
+      outside = np.flatnonzero(~mask)
+      if len(inside) == 0 or len(outside) == 0:
+        break
+
+      # The items left out sorted by weight, with the most valuable one up to each
+      # weight, answer "best item that fits into this room" with a binary search.
+      order = outside[np.argsort(weights[outside], kind='stable')]
+      sorted_weights = weights[order]
+      best_values = np.maximum.accumulate(values[order])
+      best_positions = np.maximum.accumulate(
+          np.where(values[order] == best_values, np.arange(len(order)), 0))
+
+      def best_fitting(rooms):
+        positions = np.searchsorted(sorted_weights, rooms, side='right') - 1
+        found = positions >= 0
+        positions = np.maximum(positions, 0)
+        gains = np.where(found, best_values[positions], -1)
+        return gains, order[best_positions[positions]]
+
+      # 1-1 swaps: one item out, the best one that fits in its place.
+      gains, added = best_fitting(room + weights[inside])
+      gains = gains - values[inside]
+      best = int(np.argmax(gains))
+      move = (gains[best], [inside[best]], added[best])
+
+      # 2-1 swaps: two items out and one in. Only the pairs among the sqrt(n) taken
+      # items with the worst benefit are tried, to keep the pass in O(n log n).
+      candidates = inside[-(int(np.sqrt(len(items))) + 1):]
+      if len(candidates) > 1:
+        first, second = np.triu_indices(len(candidates), 1)
+        first, second = candidates[first], candidates[second]
+        gains, added = best_fitting(room + weights[first] + weights[second])
+        gains = gains - values[first] - values[second]
+        best = int(np.argmax(gains))
+        if gains[best] > move[0]:
+          move = (gains[best], [first[best], second[best]], added[best])
+
+      gain, removed, added = move
+      if gain <= 0:
+        break
+      mask[removed] = False
+      mask[added] = True
+      mask = fill_leftover(items, capacity, mask)
+
+    return mask
+
+
+def fill_knapsack_improved(items, capacity, amount_items=None):
+    if amount_items is None:
+      amount_items = len(items)
+
+    # The greedy by benefit, improved with local search moves.
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    mask = improve_knapsack(items, capacity, greedy_mask(items.weight, capacity))
+
+    optimal = 0
+    value = int(items.value[mask].sum())
+    return value, items.taken(mask, amount_items), optimal
 
 
 def fill_knapsack_dinamically(items, capacity, amount_items=None):
-    
-    # I order the values descendant by benefit
-    # I don't need to break equalities. It's the same for me.
-    items.sort(key=lambda item: item.benefit, reverse=True)
-    
+    ''' Returns the optimal solution of the DP over capacities; it is fill_knapsack_numpy '''
+    return fill_knapsack_numpy(items, capacity, amount_items)
+
+
+def knapsack_dp_row_update(best, weight, value):
+    ''' Updates in place the DP row with one item and returns where it was taken '''
+    # best[c] is the best value reachable with capacity c using the previous items.
+    # Shifting the row by the weight of the item gives, for each capacity, the value
+    # I'd get by putting the item into the knapsack. The candidate is a new array, so
+    # np.maximum doesn't read cells it has already overwritten.
+    if weight == 0:
+      candidate = best + value
+      take = candidate > best
+      np.maximum(best, candidate, out=best)
+      return take
+
+    take = np.zeros(len(best), dtype=bool)
+    candidate = best[:-weight] + value
+    np.greater(candidate, best[weight:], out=take[weight:])
+    np.maximum(best[weight:], candidate, out=best[weight:])
+    return take
+
+
+def dp_table_bytes(amount_items, capacity, packed=True):
+    ''' Returns the memory the DP decision table needs for the traceback '''
+    if packed:
+      return amount_items * ((capacity + 8) // 8)
+    return amount_items * (capacity + 1)
+
+
+def knapsack_dp_select(items, capacity, packed=True):
+    ''' Solves the DP over the given items and returns the value and the chosen items '''
+    # Only one row of values over the capacities is kept alive. For the traceback
+    # I record a "taken" flag for each (item, capacity) cell. When packed, each row
+    # of flags is stored as bits (8 cells per byte) instead of one bool per cell.
+    best = np.zeros(capacity + 1, dtype=np.int64)
+    if packed:
+      decisions = np.zeros((len(items), (capacity + 8) // 8), dtype=np.uint8)
+    else:
+      decisions = np.zeros((len(items), capacity + 1), dtype=bool)
+
+    for k, item in enumerate(items):
+      take = knapsack_dp_row_update(best, item.weight, item.value)
+      decisions[k] = np.packbits(take) if packed else take
+
+    return int(best[capacity]), knapsack_dp_traceback(items, decisions, capacity, packed)
+
+
+def knapsack_dp_traceback(items, decisions, capacity, packed=True, by_value=False):
+    ''' Returns the items taken according to the DP decision table '''
+    # The table columns are capacities, or profits when the DP is indexed by value.
+    chosen = []
+    c = capacity
+    for k in range(len(items) - 1, -1, -1):
+      if packed:
+        # np.packbits stores the first cell in the most significant bit.
+        was_taken = (decisions[k, c >> 3] >> (7 - (c & 7))) & 1
+      else:
+        was_taken = decisions[k, c]
+      if was_taken:
+        chosen.append(items[k])
+        c -= items[k].value if by_value else items[k].weight
+    return chosen
+
+
+def fill_knapsack_numpy(items, capacity, amount_items=None, packed=True):
     # I remember the amount of items, because I am going to remove some of them.
     if amount_items is None:
       amount_items = len(items)
-    
+
     # I remove elements heavier than the allowed capacity:
-    items = filter(lambda i: i.weight < capacity, items)
-
-    # I need to fill the table recording the values I used in each column
-    # For each item I have to decide for each capacity if I put it into the knapsack or not.
-    # To decide that, I need to take a look at two cells: the left one, and the one located 
-    # in the left column but size(i) rows up
-
-    # Remember that in math notation the first index of a matrix 
-    # indicates the row, and the second indicates the column.
-
-    taken = [0 for j in xrange(amount_items)]
-    values_table = [[0 for j in xrange(len(items)+1)] for i in xrange(capacity)]
-    weights_table = [[0 for j in xrange(len(items)+1)] for i in xrange(capacity)]
-
-    # for each item
-    for i in xrange(1, len(items)+1):
-      item_idx = i - 1
-      item = items[item_idx]
-      
-      # for each capacity
-      for c in xrange(1, capacity+1):
-        c_idx = c-1
-        
-        # if the element doesn't fit into the knapsack
-        if item.weight > c:
-          values_table[c_idx][i] = values_table[c_idx][i-1]
-          weights_table[c_idx][i] = weights_table[c_idx][i-1]
-        
-        # if there is space to put the element in the knapsack without modifying its items:
-        elif c - weights_table[c_idx][i-1] >= item.weight:
-            values_table[c_idx][i] = values_table[c_idx][i-1] + item.value
-            weights_table[c_idx][i] = weights_table[c_idx][i-1] + item.weight
-        
-        #  if I can get a big value removing elements that allow me to put the actual
-        else:
-          if c_idx-item.weight <= 0:
-            last_value = 0
-            last_weight = 0
-          else: 
-            last_value = values_table[c_idx-item.weight][i-1]
-            last_weight = weights_table[c_idx-item.weight][i-1]
-          
-          if values_table[c_idx][i-1] < last_value + item.value:
-            values_table[c_idx][i] = last_value + item.value
-            weights_table[c_idx][i] = last_weight + item.weight
-          else:
-            values_table[c_idx][i] = values_table[c_idx][i-1]
-            weights_table[c_idx][i] = weights_table[c_idx][i-1]
-
-    # For Debug purposes
-    # print 'cap\t', [(i.weight, i.value) for i in items]
-    # for j in xrange(capacity):
-    #   print j+1, '\t',
-    #   for i in xrange(len(items)+1):
-    #     print values_table[j][i], '\t',
-    #   print
+    items = ItemStore.from_items(items).fitting(capacity)
+
+    value, chosen = knapsack_dp_select(items, capacity, packed)
 
     # Calculating the results
-    max_c = capacity - 1
-    max_i = len(items)
-    max_value = values_table[max_c][max_i]
-    max_weight = weights_table[max_c][max_i]
+    taken = [0] * amount_items
+    for item in chosen:
+      taken[item.index] = 1
+
     optimal = 1
-    i = max_i
-    c = max_c
-    if debug:
-      calculated_weight = 0
-      calculated_value = 0
-    
-    while i >= 0:
-      while c >= 0:
-        if values_table[c][i] != values_table[c][i-1]:
-            if debug:
-              calculated_weight += items[i-1].weight
-              calculated_value += items[i-1].value
-              item_idx = items[i-1].index
-              # print 'estoy en la columna', i, 'que apunta al item', i-1, items[i-1]
-            taken[item_idx] = 1
-            c -= items[i-1].weight
+    return value, taken, optimal
+
+
+def knapsack_dp_value_row_update(lightest, weight, value):
+    ''' Updates in place the DP row indexed by profit and returns where it was taken '''
+    # lightest[p] is the minimum weight needed to reach exactly the profit p with
+    # the previous items. It is the same shifting as by capacity, with np.minimum.
+    take = np.zeros(len(lightest), dtype=bool)
+    if value == 0:
+      return take
+    candidate = lightest[:-value] + weight
+    np.less(candidate, lightest[value:], out=take[value:])
+    np.minimum(lightest[value:], candidate, out=lightest[value:])
+    return take
+
+
+def fill_knapsack_by_value(items, capacity, amount_items=None, packed=True):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I remove elements heavier than the allowed capacity:
+    items = ItemStore.from_items(items).fitting(capacity)
+
+    # No solution is worth more than the fractional relaxation, so the row of
+    # profits ends there. Unreachable profits weigh more than anything.
+    profit = int(calculate_upperbound(items.sorted_by_benefit(), capacity) + 1e-9)
+    unreachable = np.iinfo(np.int64).max // 2
+    lightest = np.full(profit + 1, unreachable, dtype=np.int64)
+    lightest[0] = 0
+    if packed:
+      decisions = np.zeros((len(items), (profit + 8) // 8), dtype=np.uint8)
+    else:
+      decisions = np.zeros((len(items), profit + 1), dtype=bool)
+
+    for k, item in enumerate(items):
+      take = knapsack_dp_value_row_update(lightest, item.weight, item.value)
+      decisions[k] = np.packbits(take) if packed else take
+
+    # The answer is the biggest profit whose minimum weight fits.
+    value = int(np.flatnonzero(lightest <= capacity)[-1])
+    chosen = knapsack_dp_traceback(items, decisions, value, packed, by_value=True)
+
+    taken = [0] * amount_items
+    for item in chosen:
+      taken[item.index] = 1
+
+    optimal = 1
+    return value, taken, optimal
+
+
+def reachable_capacities(items, capacity):
+    ''' Returns the sorted weights of every subset of items that fit into the capacity '''
+    # Bit c of a big integer says if some subset weighs exactly c. Each item adds
+    # the shifted copy of the set, and the bits over the capacity are dropped.
+    limit = (1 << (capacity + 1)) - 1
+    reachable = 1
+    for weight in items.weight.tolist():
+      reachable = (reachable | (reachable << weight)) & limit
+    packed = np.frombuffer(reachable.to_bytes((capacity + 8) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder='little')[:capacity + 1])
+
+
+def fill_knapsack_reachable(items, capacity, amount_items=None):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I remove elements heavier than the allowed capacity, and divide the weights
+    # and the capacity by the GCD of the weights.
+    items = ItemStore.from_items(items).fitting(capacity)
+    items, capacity, _ = scale_knapsack(items, capacity)
+
+    # The DP only has a column for each capacity some subset weighs exactly.
+    # best[j] is the best value of the subsets of the previous items that weigh
+    # exactly sums[j], and very negative when none does.
+    sums = reachable_capacities(items, capacity)
+    best = np.full(len(sums), -(np.iinfo(np.int64).max // 2), dtype=np.int64)
+    best[0] = 0
+    decisions = np.zeros((len(items), (len(sums) + 7) // 8), dtype=np.uint8)
+
+    for k, item in enumerate(items):
+      # The column of sums[j] - weight, when that weight is reachable too.
+      sources = np.searchsorted(sums, sums - item.weight)
+      valid = np.flatnonzero(sources < len(sums))
+      valid = valid[sums[sources[valid]] == sums[valid] - item.weight]
+      candidate = best[sources[valid]] + item.value
+      take = np.zeros(len(sums), dtype=bool)
+      take[valid] = candidate > best[valid]
+      best[valid] = np.maximum(best[valid], candidate)
+      decisions[k] = np.packbits(take)
+
+    column = int(np.argmax(best))
+    value = int(best[column])
+    taken = [0] * amount_items
+    for k in range(len(items) - 1, -1, -1):
+      if (decisions[k, column >> 3] >> (7 - (column & 7))) & 1:
+        item = items[k]
+        taken[item.index] = 1
+        column = int(np.searchsorted(sums, sums[column] - item.weight))
+
+    optimal = 1
+    return value, taken, optimal
+
+
+def fptas_scale(items, epsilon):
+    ''' Returns the profit unit of the FPTAS for the given epsilon '''
+    # Rounding every value down to a multiple of the unit loses less than the unit
+    # per item, so less than epsilon times the most valuable item in total.
+    if len(items) == 0:
+      return 1.0
+    return max(1.0, epsilon * int(items.value.max()) / len(items))
+
+
+def fill_knapsack_fptas(items, capacity, amount_items=None, epsilon=0.1):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I remove elements heavier than the allowed capacity:
+    items = ItemStore.from_items(items).fitting(capacity)
+
+    # I solve exactly the instance with the scaled profits, which are at most n/epsilon
+    # each, and keep the solution with its original values.
+    unit = fptas_scale(items, epsilon)
+    scaled = ItemStore(items.index, np.floor(items.value / unit).astype(np.int64), items.weight)
+    _, taken, _ = fill_knapsack_by_value(scaled, capacity, amount_items)
+    value = sum(i.value for i in items if taken[i.index])
+
+    # It is only proven optimal if it reaches the fractional bound.
+    upper_bound = calculate_upperbound(items.sorted_by_benefit(), capacity)
+    optimal = 1 if value == int(upper_bound + 1e-9) else 0
+    return value, taken, optimal
+
+
+def knapsack_gap(items, capacity, value):
+    ''' Returns the relative gap between a value and the fractional upper bound '''
+    items = ItemStore.from_items(items).fitting(capacity)
+    upper_bound = calculate_upperbound(items.sorted_by_benefit(), capacity)
+    if upper_bound <= 0:
+      return 0.0
+    return max(0.0, (int(upper_bound + 1e-9) - value) / float(upper_bound))
+
+
+def knapsack_dp_shard(names, weights, values, width, lo, hi, barrier):
+    ''' Fills the capacities from lo to hi of every DP row (run by each worker) '''
+    n = len(weights)
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+      rows = [np.ndarray(width, dtype=np.int64, buffer=block.buf) for block in blocks[:2]]
+      decisions = np.ndarray((n, (width + 7) // 8), dtype=np.uint8, buffer=blocks[2].buf)
+      take = np.zeros(hi - lo, dtype=bool)
+      for k in range(n):
+        # The rows alternate: one holds the previous item and the other the current.
+        previous, current = rows[k % 2], rows[(k + 1) % 2]
+        weight, value = weights[k], values[k]
+        start = min(max(lo, weight), hi)
+        current[lo:start] = previous[lo:start]
+        take[:] = False
+        candidate = previous[start-weight:hi-weight] + value
+        np.greater(candidate, previous[start:hi], out=take[start-lo:])
+        np.maximum(previous[start:hi], candidate, out=current[start:hi])
+        decisions[k, lo // 8:(hi + 7) // 8] = np.packbits(take)
+        # Nobody starts the next item until every shard of this one is written.
+        barrier.wait()
+    except BaseException:
+      # The other workers would wait for this one forever, so I break the barrier.
+      barrier.abort()
+      raise
+    finally:
+      for block in blocks:
+        block.close()
+
+
+def fill_knapsack_parallel(items, capacity, amount_items=None, workers=None):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+    if workers is None:
+      workers = multiprocessing.cpu_count()
+
+    # I remove elements heavier than the allowed capacity:
+    items = ItemStore.from_items(items).fitting(capacity)
+    n = len(items)
+    width = capacity + 1
+
+    # The two DP rows and the packed decision table live in shared memory, so the
+    # workers read and write them without pickling anything.
+    sizes = [8 * width, 8 * width, max(1, n * ((width + 7) // 8))]
+    blocks = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+    try:
+      rows = [np.ndarray(width, dtype=np.int64, buffer=block.buf) for block in blocks[:2]]
+      rows[0][:] = 0
+      decisions = np.ndarray((n, (width + 7) // 8), dtype=np.uint8, buffer=blocks[2].buf)
+
+      # Each worker owns a range of capacities. The ranges start at multiples of 8
+      # so the packed bits of different workers never share a byte.
+      shard = ((width + workers - 1) // workers + 7) // 8 * 8
+      bounds = [(lo, min(lo + shard, width)) for lo in range(0, width, shard)]
+      barrier = multiprocessing.Barrier(len(bounds))
+      weights = items.weight.tolist()
+      values = items.value.tolist()
+      names = [block.name for block in blocks]
+      processes = [multiprocessing.Process(target=knapsack_dp_shard,
+                                           args=(names, weights, values, width, lo, hi, barrier))
+                   for lo, hi in bounds]
+      for process in processes:
+        process.start()
+      # A worker that is killed can't break the barrier itself, so I break it when
+      # any worker ends badly, and the others leave it with an error.
+      running = list(processes)
+      while running:
+        multiprocessing.connection.wait([process.sentinel for process in running])
+        running = [process for process in running if process.is_alive()]
+        if any(process.exitcode not in (None, 0) for process in processes):
+          barrier.abort()
+      for process in processes:
+        process.join()
+      if any(process.exitcode != 0 for process in processes):
+        raise RuntimeError('A worker of the parallel DP failed')
+
+      value = int(rows[n % 2][capacity])
+      chosen = knapsack_dp_traceback(items, decisions, capacity)
+      del rows, decisions
+    finally:
+      for block in blocks:
+        block.close()
+        block.unlink()
+
+    taken = [0] * amount_items
+    for item in chosen:
+      taken[item.index] = 1
+
+    optimal = 1
+    return value, taken, optimal
+
+
+def knapsack_dp_best_row(items, capacity):
+    ''' Returns the best value for every capacity from 0 to capacity '''
+    best = np.zeros(capacity + 1, dtype=np.int64)
+    for item in items:
+      if item.weight <= capacity:
+        knapsack_dp_row_update(best, item.weight, item.value)
+    return best
+
+
+def knapsack_divide_and_conquer(items, capacity, chosen, leaf_bytes):
+    ''' Appends to chosen the items of an optimal solution using O(capacity) memory '''
+    # When the decision table of this subproblem is small enough, I solve it directly.
+    if len(items) <= 1 or dp_table_bytes(len(items), capacity) <= leaf_bytes:
+      chosen.extend(knapsack_dp_select(items, capacity)[1])
+      return
+
+    # I split the items in two halves and, using only the last DP row of each one,
+    # I look for the best way to share the capacity between them.
+    middle = len(items) // 2
+    first, second = items[:middle], items[middle:]
+    first_row = knapsack_dp_best_row(first, capacity)
+    second_row = knapsack_dp_best_row(second, capacity)
+    split = int(np.argmax(first_row + second_row[::-1]))
+    del first_row, second_row
+
+    knapsack_divide_and_conquer(first, split, chosen, leaf_bytes)
+    knapsack_divide_and_conquer(second, capacity - split, chosen, leaf_bytes)
+
+
+def fill_knapsack_hirschberg(items, capacity, amount_items=None, leaf_bytes=2**24):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I remove elements heavier than the allowed capacity:
+    items = ItemStore.from_items(items).fitting(capacity)
+
+    chosen = []
+    knapsack_divide_and_conquer(items, capacity, chosen, leaf_bytes)
+
+    value = 0
+    taken = [0] * amount_items
+    for item in chosen:
+      taken[item.index] = 1
+      value += item.value
+
+    optimal = 1
+    return value, taken, optimal
+
+
+def fill_knapsack_pareto(items, capacity, amount_items=None, max_states=10**7):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I order the items descendant by benefit to bound the states with the
+    # fractional relaxation of the items still to come.
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    oracle = UpperBoundOracle(items)
+    incumbent = fill_knapsack_improved(items, capacity, amount_items)[0]
+
+    # Instead of a row indexed by capacity, I keep only the non-dominated states:
+    # weights sorted ascendant with strictly increasing values. For each item and
+    # state I remember the state of the previous layer it comes from and if the
+    # item was taken, to rebuild the solution.
+    weights = np.zeros(1, dtype=np.int64)
+    values = np.zeros(1, dtype=np.int64)
+    parents = []
+    for item in items:
+      fits = weights <= capacity - item.weight
+      all_weights = np.concatenate((weights, weights[fits] + item.weight))
+      all_values = np.concatenate((values, values[fits] + item.value))
+      all_parents = np.concatenate((np.arange(len(weights)), np.flatnonzero(fits)))
+      all_taken = np.concatenate((np.zeros(len(weights), dtype=bool),
+                                  np.ones(np.count_nonzero(fits), dtype=bool)))
+
+      # I order the states by weight (the most valuable first on ties), and keep
+      # the ones worth more than every lighter state.
+      order = np.lexsort((-all_values, all_weights))
+      sorted_values = all_values[order]
+      keep = np.ones(len(order), dtype=bool)
+      keep[1:] = sorted_values[1:] > np.maximum.accumulate(sorted_values)[:-1]
+
+      # I also drop the states that can't reach the incumbent anymore.
+      k = len(parents) + 1
+      upper_bounds = sorted_values + oracle.bounds(k, capacity - all_weights[order])
+      keep &= np.floor(upper_bounds + 1e-9) >= incumbent
+      order = order[keep]
+      if len(order) > max_states:
+        raise MemoryError('The Pareto frontier has more than {} states'.format(max_states))
+
+      weights, values = all_weights[order], all_values[order]
+      parents.append((all_parents[order], all_taken[order]))
+
+    # The heaviest state is the most valuable one.
+    taken = [0] * amount_items
+    state = len(values) - 1
+    for k in range(len(items) - 1, -1, -1):
+      parent, was_taken = parents[k]
+      if was_taken[state]:
+        taken[items[k].index] = 1
+      state = parent[state]
+
+    optimal = 1
+    return int(values[-1]), taken, optimal
+
+
+def subset_sums(items):
+    ''' Returns the weight and value of every subset; the position is its bit mask '''
+    weights = np.zeros(1, dtype=np.int64)
+    values = np.zeros(1, dtype=np.int64)
+    for item in items:
+      weights = np.concatenate((weights, weights + item.weight))
+      values = np.concatenate((values, values + item.value))
+    return weights, values
+
+
+def fill_knapsack_meet_in_the_middle(items, capacity, amount_items=None):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I remove elements heavier than the allowed capacity:
+    items = ItemStore.from_items(items).fitting(capacity)
+
+    # I enumerate the subsets of each half of the items (2^(n/2) each one).
+    middle = len(items) // 2
+    first, second = items[:middle], items[middle:]
+    first_weights, first_values = subset_sums(first)
+    second_weights, second_values = subset_sums(second)
+
+    # I order the second half by weight and keep, for each position, the most
+    # valuable subset among the ones that are lighter or equal.
+    order = np.argsort(second_weights, kind='stable')
+    second_weights = second_weights[order]
+    second_values = second_values[order]
+    best_values = np.maximum.accumulate(second_values)
+    positions = np.where(second_values == best_values, np.arange(len(order)), 0)
+    best_positions = np.maximum.accumulate(positions)
+
+    # For each subset of the first half that fits, the best complement is the
+    # most valuable subset of the second half that fits in the remaining room.
+    masks = np.flatnonzero(first_weights <= capacity)
+    rooms = capacity - first_weights[masks]
+    complements = np.searchsorted(second_weights, rooms, side='right') - 1
+    totals = first_values[masks] + best_values[complements]
+    best = int(np.argmax(totals))
+
+    first_mask = int(masks[best])
+    second_mask = int(order[best_positions[complements[best]]])
+    taken = [0] * amount_items
+    for k, item in enumerate(first):
+      if first_mask >> k & 1:
+        taken[item.index] = 1
+    for k, item in enumerate(second):
+      if second_mask >> k & 1:
+        taken[item.index] = 1
+
+    optimal = 1
+    return int(totals[best]), taken, optimal
+
+
+def fill_knapsack_branch_and_bound(items, capacity, amount_items=None, time_limit=None, callback=None):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    # I order the values descendant by benefit, so the fractional relaxation of the
+    # remaining items is a good bound and the first branches are the greedy ones.
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    n = len(items)
+    deadline = None if time_limit is None else time.time() + time_limit
+    oracle = UpperBoundOracle(items)
+    weights, values = oracle.item_weights, oracle.item_values
+
+    best_value = 0
+    best_path = []
+    optimal = 1
+
+    # Depth first search with an explicit stack. Each entry is the node reached
+    # after deciding the item depth-1, and path keeps the decisions of the node
+    # being explored (it is truncated each time I go back up in the tree).
+    path = []
+    stack = [(0, 0, capacity, None)]
+    explored = 0
+    while stack:
+      depth, value, room, decision = stack.pop()
+      if depth > 0:
+        del path[depth-1:]
+        path.append(decision)
+
+      explored += 1
+      if deadline is not None and explored % 1024 == 0 and time.time() > deadline:
+        optimal = 0
         break
-      i -= 1
-    
+
+      if value > best_value:
+        best_value = value
+        best_path = list(path)
+        # Every improved solution goes to the callback, as (value, taken).
+        if callback is not None:
+          mask = np.zeros(n, dtype=bool)
+          mask[:len(best_path)] = best_path
+          callback(best_value, items.taken(mask, amount_items))
+
+      if depth == n:
+        continue
+
+      # I prune the node if even the fractional relaxation can't beat the incumbent.
+      upper_bound = value + oracle.bound(depth, room)
+      if int(upper_bound + 1e-9) <= best_value:
+        continue
+
+      # The branch that leaves the item out is pushed first so the one that
+      # takes it is explored first.
+      stack.append((depth + 1, value, room, 0))
+      if weights[depth] <= room:
+        stack.append((depth + 1, value + values[depth], room - weights[depth], 1))
+
+    mask = np.zeros(n, dtype=bool)
+    mask[:len(best_path)] = best_path
+    return best_value, items.taken(mask, amount_items), optimal
+
+
+def fill_knapsack_core(items, capacity, amount_items=None, core_size=50, time_limit=None,
+                       callback=None):
+    # I remember the amount of items, because I am going to remove some of them.
+    if amount_items is None:
+      amount_items = len(items)
+
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    n = len(items)
+    oracle = UpperBoundOracle(items)
+    deadline = None if time_limit is None else time.time() + time_limit
+
+    # The improved greedy solution is my first incumbent. The break item is the first
+    # one the greedy can't put into the knapsack when it takes them in order.
+    best_value, best_taken, optimal = fill_knapsack_improved(items, capacity, amount_items)
+    if callback is not None:
+      callback(best_value, best_taken)
+    brk = bisect.bisect_right(oracle.weights, capacity) - 1
+    if brk == n:
+      return best_value, best_taken, 1
+
+    # An item is wrongly fixed if flipping it could beat the incumbent.
+    flipped = np.floor(oracle.bounds_flipped(brk, capacity) + 1e-9)
+
+    half = max(1, core_size // 2)
+    while True:
+      # Items before the core are fixed into the knapsack and items after it
+      # are fixed out. Only the core is solved exactly.
+      lo, hi = max(0, brk - half), min(n, brk + half)
+      core = items[lo:hi]
+      room = capacity - oracle.weights[lo]
+      core_optimal = 1
+      if len(core) * (room + 1) <= CORE_DP_MAX_CELLS:
+        core_value, chosen = knapsack_dp_select(core, room)
+      else:
+        # The solutions the branch and bound finds in the core go to the callback
+        # with the items fixed before the core.
+        def core_found(core_value, core_taken, lo=lo):
+          if oracle.values[lo] + core_value > best_value:
+            fixed = items[:lo].taken(slice(None), amount_items)
+            callback(oracle.values[lo] + core_value, [t | f for t, f in zip(core_taken, fixed)])
+
+        remaining = None if deadline is None else max(0, deadline - time.time())
+        core_value, core_taken, core_optimal = fill_knapsack_branch_and_bound(
+            core, room, amount_items, time_limit=remaining,
+            callback=None if callback is None else core_found)
+        chosen = [i for i in core if core_taken[i.index]]
+
+      if oracle.values[lo] + core_value > best_value:
+        best_value = oracle.values[lo] + core_value
+        best_taken = items[:lo].taken(slice(None), amount_items)
+        for item in chosen:
+          best_taken[item.index] = 1
+        if callback is not None:
+          callback(best_value, best_taken)
+
+      # If the core couldn't be solved in time, the incumbent isn't proven.
+      if not core_optimal:
+        return best_value, best_taken, 0
+
+      if lo == 0 and hi == n:
+        return best_value, best_taken, 1
+
+      # The fixed items are right if flipping any of them can't beat the incumbent.
+      outside = np.ones(n, dtype=bool)
+      outside[lo:hi] = False
+      wrong = np.flatnonzero(outside & (flipped > best_value))
+
+      if len(wrong) == 0:
+        return best_value, best_taken, 1
+      if deadline is not None and time.time() > deadline:
+        return best_value, best_taken, 0
+
+      # I widen the core at least twice, and enough to contain the wrong items.
+      half = max(2 * half, brk - int(wrong[0]), int(wrong[-1]) + 1 - brk)
+
+
+def scale_knapsack(items, capacity):
+    ''' Divides the weights and the capacity by the GCD of the weights '''
+    if not items:
+      return items, capacity, 1
+    items = ItemStore.from_items(items)
+    divisor = int(np.gcd.reduce(items.weight))
+    if divisor <= 1:
+      return items, capacity, 1
+    items = ItemStore(items.index, items.value, items.weight // divisor)
+    return items, capacity // divisor, divisor
+
+
+def estimate_knapsack_engines(items, capacity):
+    ''' Returns the estimated seconds and bytes each exact engine needs '''
+    items = ItemStore.from_items(items)
+    n = len(items)
+    # The DP never needs more capacities than the sum of the weights.
+    width = min(capacity, int(items.weight.sum())) + 1
+    total_value = int(items.value.sum()) + 1
+
+    estimates = {}
+    dp_cells = n * width
+    estimates['dp'] = (dp_cells * DP_CELL_SECONDS,
+                       dp_table_bytes(n, width - 1) + 4 * 8 * width)
+    workers = multiprocessing.cpu_count()
+    if workers > 1:
+      # Every item costs a barrier (about 0.1 ms) on top of its share of the row,
+      # and every worker costs starting its process.
+      method = multiprocessing.get_start_method(allow_none=True) or multiprocessing.get_all_start_methods()[0]
+      start_seconds = workers * PROCESS_START_SECONDS.get(method, PROCESS_START_SECONDS['spawn'])
+      estimates['parallel_dp'] = (dp_cells * DP_CELL_SECONDS / workers + n * 1e-4 + start_seconds,
+                                  dp_table_bytes(n, width - 1) + 4 * 8 * width)
+    # Indexed by profit, the row ends at the fractional bound of the value.
+    profit_width = min(total_value, int(calculate_upperbound(items.sorted_by_benefit(), capacity)) + 1)
+    estimates['dp_by_value'] = (n * profit_width * DP_CELL_SECONDS,
+                                dp_table_bytes(n, profit_width - 1) + 4 * 8 * profit_width)
+    estimates['hirschberg'] = (2 * dp_cells * DP_CELL_SECONDS, 8 * 8 * width + 2**24)
+
+    # The frontier has at most one state per capacity and per total value, and
+    # 2^k after k items. The powers of 2 are only summed while they are under that
+    # cap, so the count never grows past n times the cap.
+    cap = min(width, total_value)
+    doubling = min(n, cap.bit_length() - 1)
+    states = (2**(doubling + 1) - 2) + (n - doubling) * cap
+    estimates['pareto'] = (states * PARETO_STATE_SECONDS, 9 * states + 6 * 8 * width)
+
+    # The DP over the reachable capacities only needs their amount, which costs
+    # computing them (a shift-or over the capacity bits per item), so I only do it
+    # when the plain DP is big and the shift-or is cheap.
+    bitset_seconds = dp_cells * BITSET_CELL_SECONDS
+    if dp_cells > 10**7 and bitset_seconds <= 0.1:
+      reachable = len(reachable_capacities(items, width - 1))
+      estimates['dp_reachable'] = (bitset_seconds + 4 * n * reachable * DP_CELL_SECONDS,
+                                   dp_table_bytes(n, reachable - 1) + 6 * 8 * reachable)
+
+    # The meet in the middle enumerates 2^(n/2) subsets per half.
+    if n <= MEET_IN_THE_MIDDLE_MAX_ITEMS:
+      subsets = 2**(n // 2) + 2**(n - n // 2)
+      estimates['meet_in_the_middle'] = (subsets * SUBSET_SECONDS, 6 * 8 * subsets)
+    return estimates
+
+
+def choose_knapsack_engine(items, capacity, time_budget=TIME_BUDGET, memory_budget=MEMORY_BUDGET,
+                           epsilon=None):
+    ''' Chooses the fastest exact engine that fits into the budgets '''
+    estimates = estimate_knapsack_engines(items, capacity)
+    fitting = [(seconds, memory, name) for name, (seconds, memory) in estimates.items()
+               if seconds <= time_budget and memory <= memory_budget]
+    instance = 'n={}, capacity={}'.format(len(items), capacity)
+    if not fitting and epsilon is not None:
+      # The FPTAS is the profit-indexed DP with profits divided by its unit.
+      items = ItemStore.from_items(items)
+      width = int(min(items.value.sum(), calculate_upperbound(items.sorted_by_benefit(), capacity))
+                  / fptas_scale(items, epsilon)) + 1
+      seconds = len(items) * width * DP_CELL_SECONDS
+      memory = dp_table_bytes(len(items), width - 1) + 4 * 8 * width
+      if seconds <= time_budget and memory <= memory_budget:
+        return EngineChoice('fptas', seconds, memory,
+                            'no exact engine fits the budgets, (1-{}) approximation ({})'.format(
+                                epsilon, instance))
+    if not fitting:
+      return EngineChoice('core', time_budget, None,
+                          'no exact engine fits the budgets ({})'.format(instance))
+
+    seconds, memory, name = min(fitting)
+    return EngineChoice(name, seconds, memory,
+                        'fastest exact engine: {:.2f} s and {:.1f} MB ({})'.format(
+                            seconds, memory / 2.0**20, instance))
+
+
+def run_knapsack_engine(choice, items, capacity, amount_items, time_budget=TIME_BUDGET,
+                        epsilon=None, callback=None):
+    ''' Runs the chosen engine, and the core solver before a slow one or if it runs out of memory or fails '''
+    engines = {
+      'fptas': lambda items, capacity, amount_items: fill_knapsack_fptas(
+          items, capacity, amount_items, epsilon),
+      'dp': fill_knapsack_numpy,
+      'parallel_dp': fill_knapsack_parallel,
+      'dp_by_value': fill_knapsack_by_value,
+      'dp_reachable': fill_knapsack_reachable,
+      'hirschberg': fill_knapsack_hirschberg,
+      'pareto': fill_knapsack_pareto,
+      'meet_in_the_middle': fill_knapsack_meet_in_the_middle,
+    }
+    if choice.name in engines:
+      if choice.seconds > CORE_TRIAL_MIN_SECONDS:
+        trial = min(CORE_TRIAL_SHARE * choice.seconds, time_budget)
+        value, taken, optimal = fill_knapsack_core(items, capacity, amount_items, time_limit=trial,
+                                                   callback=callback)
+        if optimal:
+          return value, taken, optimal
+      try:
+        return engines[choice.name](items, capacity, amount_items)
+      except (MemoryError, RuntimeError):
+        # Out of memory, or a worker of the parallel DP failed.
+        pass
+    return fill_knapsack_core(items, capacity, amount_items, time_limit=time_budget, callback=callback)
+
+
+def reduce_knapsack(items, capacity, amount_items=None, incumbent=None):
+    ''' Fixes the items that LP bounds prove to be in or out of an optimal solution '''
+    if amount_items is None:
+      amount_items = len(items)
+
+    items = ItemStore.from_items(items).fitting(capacity).sorted_by_benefit()
+    n = len(items)
+    oracle = UpperBoundOracle(items)
+
+    # The improved greedy solution is the incumbent every bound is compared with,
+    # unless the caller already has one as (value, taken).
+    if incumbent is None:
+      incumbent = fill_knapsack_improved(items, capacity, amount_items)[:2]
+    incumbent_value, incumbent_taken = incumbent
+    brk = bisect.bisect_right(oracle.weights, capacity) - 1
+
+    # If flipping the greedy decision of an item can't beat the incumbent, I fix it.
+    # The break item is always left free.
+    free = np.floor(oracle.bounds_flipped(brk, capacity) + 1e-9) > incumbent_value
+    if brk < n:
+      free[brk] = True
+    fixed_in = ~free
+    fixed_in[brk:] = False
+
+    fixed = items.taken(fixed_in, amount_items)
+    fixed_value = int(items.value[fixed_in].sum())
+    room = capacity - int(items.weight[fixed_in].sum())
+    return KnapsackReduction(items[free], room, fixed, fixed_value, incumbent_value, incumbent_taken)
+
+
+def expand_reduced_solution(reduction, value, taken, optimal):
+    ''' Adds the fixed items to the solution of a reduced instance '''
+    # The fixings only hold for solutions better than the incumbent, so if the
+    # reduced instance can't beat it, the incumbent is the answer.
+    value += reduction.fixed_value
+    if value < reduction.incumbent_value:
+      return reduction.incumbent_value, list(reduction.incumbent_taken), optimal
+    taken = [t | f for t, f in zip(taken, reduction.fixed)]
+    return value, taken, optimal
+
+
+def items_from_numbers(numbers):
+    ''' Returns the capacity and the items from all the numbers of an instance '''
+    item_count, capacity = int(numbers[0]), int(numbers[1])
+    # After the header, the numbers are the (value, weight) pairs of the items.
+    pairs = numbers[2:2 + 2*item_count].reshape(item_count, 2)
+    return capacity, ItemStore(np.arange(item_count), pairs[:, 0], pairs[:, 1])
+
+
+def parse_knapsack(input_data):
+    ''' Parses an instance in the ks_* format with a single NumPy tokenizing pass '''
+    return items_from_numbers(np.fromstring(input_data, dtype=np.int64, sep=' '))
+
+
+def load_knapsack(file_location):
+    ''' Reads an instance in the ks_* format straight from the file into NumPy '''
+    return items_from_numbers(np.fromfile(file_location, dtype=np.int64, sep=' '))
+
+
+def solve_knapsack(items, capacity, epsilon=None):
+    amount_items = len(items)
+
+    # I fix the items the LP bounds decide, and solve only the free ones.
+    reduction = reduce_knapsack(items, capacity)
+
+    # If the incumbent already reaches the bound, it is optimal and there is
+    # nothing left to search.
+    if reduction.incumbent_value >= knapsack_upper_bound(items, capacity):
+        if debug:
+            sys.stderr.write('engine: none (the incumbent reaches the upper bound)\n')
+        return reduction.incumbent_value, list(reduction.incumbent_taken), 1
+
+    free, room, _ = scale_knapsack(reduction.items, reduction.capacity)
+
+    # The engine is chosen by its estimated time and memory on the reduced instance.
+    # With an epsilon, a (1-epsilon) approximation is preferred over the core
+    # solver when no exact engine fits.
+    choice = choose_knapsack_engine(free, room, epsilon=epsilon)
+    if debug:
+        sys.stderr.write('engine: {} ({})\n'.format(choice.name, choice.reason))
+    value, taken, optimal = run_knapsack_engine(choice, free, room, amount_items, epsilon=epsilon)
+    # value, taken, optimal = fill_knapsack_heuristically(free, room)
+    value, taken, optimal = expand_reduced_solution(reduction, value, taken, optimal)
     if debug:
-      assert calculated_value == max_value
-      assert calculated_weight == max_weight
-      assert max_weight <= capacity
+        sys.stderr.write('gap: {:.6f}\n'.format(knapsack_gap(items, capacity, value)))
+    return value, taken, optimal
 
-    return max_value, taken, optimal
 
+def solve_knapsack_anytime(items, capacity, time_limit, epsilon=None):
+    ''' Yields every improved Incumbent until the instance is solved or time runs out '''
+    deadline = time.time() + time_limit
+    amount_items = len(items)
+    items = ItemStore.from_items(items)
 
-def solve_it(input_data):
-    # parse the input
-    lines = input_data.split('\n')
-
-    firstLine = lines[0].split()
-    item_count = int(firstLine[0])
-    capacity = int(firstLine[1])
-    
-    items = []
-
-    # We could sort the array here to improve computational average times but it is the same in terms of complexity.
-    for i in xrange(1, item_count+1):
-        line = lines[i]
-        parts = line.split()
-        items.append(Item(i-1, int(parts[0]), int(parts[1]), float(parts[0])/int(parts[1])))
-
-    # value, taken, optimal = fill_knapsack_greedy(items, capacity)
-    if len(items)<=200:
-        value, taken, optimal = fill_knapsack_dinamically(items, capacity)
-    else :
-        value, taken, optimal = fill_knapsack_heuristically(items, capacity)
-        # value, taken, optimal = fill_knapsack_greedy(items, capacity)
+    def improved(value, taken, optimal):
+      return Incumbent(value, taken, knapsack_gap(items, capacity, value), optimal)
+
+    # First the greedy in order of benefit, which is immediate.
+    value, taken, optimal = fill_knapsack_greedy(items.fitting(capacity).sorted_by_benefit(),
+                                                 capacity, amount_items)
+    best_value = value
+    yield improved(value, taken, optimal)
+    if time.time() >= deadline:
+      return
+
+    # Then the local search on top of the greedy. If it reaches the upper bound,
+    # it is optimal and I don't need the exact search.
+    value, taken, optimal = fill_knapsack_improved(items, capacity, amount_items)
+    if value >= knapsack_upper_bound(items, capacity):
+      yield improved(value, taken, 1)
+      return
+    if value > best_value:
+      best_value = value
+      yield improved(value, taken, optimal)
+    if time.time() >= deadline:
+      return
+
+    # Finally the exact search on the reduced instance, with the local search
+    # solution as its incumbent. Only the engines expected to end well before the
+    # deadline are allowed; otherwise the core solver runs until the deadline.
+    reduction = reduce_knapsack(items, capacity, amount_items, incumbent=(value, taken))
+    free, room, _ = scale_knapsack(reduction.items, reduction.capacity)
+    remaining = deadline - time.time()
+    if remaining <= 0:
+      return
+    choice = choose_knapsack_engine(free, room, time_budget=remaining * ANYTIME_SAFETY, epsilon=epsilon)
+    if choice.name == 'core':
+      choice = choice._replace(seconds=remaining)
+    if debug:
+      sys.stderr.write('engine: {} ({})\n'.format(choice.name, choice.reason))
+
+    # The engine runs in a thread, so the solutions it finds on the way can be
+    # yielded while it goes on searching.
+    found = Queue()
+    def on_solution(value, taken):
+      found.put(('found', (value, taken, 0)))
+    def search():
+      try:
+        result = run_knapsack_engine(choice, free, room, amount_items, time_budget=choice.seconds,
+                                     epsilon=epsilon, callback=on_solution)
+        found.put(('done', result))
+      except BaseException as error:
+        found.put(('error', error))
+    searcher = threading.Thread(target=search)
+    searcher.daemon = True
+    searcher.start()
+
+    # The engine estimate may be wrong, so I don't wait for it past the deadline:
+    # the last incumbent yielded is the answer, and the thread is left behind.
+    while True:
+      try:
+        kind, result = found.get(timeout=max(0, deadline - time.time()))
+      except Empty:
+        return
+      if kind == 'error':
+        raise result
+      value, taken, optimal = expand_reduced_solution(reduction, *result)
+      if value > best_value or (kind == 'done' and optimal):
+        best_value = value
+        yield improved(value, taken, optimal)
+      if kind == 'done':
+        return
 
+
+def prepare_return_data(value, taken, optimal):
     # prepare the solution in the specified output format
     output_data = str(value) + ' ' + str(optimal) + '\n'
     output_data += ' '.join(map(str, taken))
     return output_data
 
 
+def solve_it(input_data, epsilon=None, time_limit=None, callback=None):
+    # parse the input
+    capacity, items = parse_knapsack(input_data)
+
+    # With a time limit, every improved solution goes to the callback and the
+    # best one found before the deadline is returned. Without one, the callback
+    # gets the final solution, with its proven gap to the fractional bound (which
+    # is how the FPTAS of a given epsilon reports its quality).
+    if time_limit is not None:
+        for incumbent in solve_knapsack_anytime(items, capacity, time_limit, epsilon):
+            if callback is not None:
+                callback(incumbent)
+        value, taken, optimal = incumbent.value, incumbent.taken, incumbent.optimal
+    else:
+        value, taken, optimal = solve_knapsack(items, capacity, epsilon)
+        if callback is not None:
+            callback(Incumbent(value, taken, knapsack_gap(items, capacity, value), optimal))
+
+    return prepare_return_data(value, taken, optimal)
+
+
 if __name__ == '__main__':
-    import sys
     if len(sys.argv) > 1:
         file_location = sys.argv[1].strip()
-        with open(file_location, 'r') as input_data_file:
-            input_data = input_data_file.read()
-        print(solve_it(input_data))
+        capacity, items = load_knapsack(file_location)
+        print(prepare_return_data(*solve_knapsack(items, capacity)))
     else:
         print('This test requires an input file.  Please select one from the data directory. (i.e. python solver.py ./data/ks_4_0)')
-
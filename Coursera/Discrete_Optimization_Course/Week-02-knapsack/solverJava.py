@@ -1,27 +1,152 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import os
+import atexit
+import struct
+import threading
+import multiprocessing
 from subprocess import Popen, PIPE
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
-def solve_it(input_data):
 
-    # Writes the inputData to a temporay file
+class JavaWorker(object):
+    """A long-lived `java Solver -worker` process."""
+
+    def __init__(self):
+        # The JVM starts once and then answers instances through stdin/stdout.
+        # Each request and response is a 4 bytes big-endian length plus UTF-8 text.
+        self.process = Popen(['java', 'Solver', '-worker'], stdin=PIPE, stdout=PIPE)
+
+    def solve(self, input_data):
+        request = input_data.encode('utf-8')
+        self.process.stdin.write(struct.pack('>i', len(request)) + request)
+        self.process.stdin.flush()
+
+        (length,) = struct.unpack('>i', self.read(4))
+        return self.read(length).decode('utf-8').strip()
+
+    def read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.process.stdout.read(size - len(data))
+            if not chunk:
+                raise EOFError('The Java worker closed its output')
+            data += chunk
+        return data
+
+    def close(self):
+        # Closing its input makes the worker leave its loop and exit.
+        try:
+            self.process.stdin.close()
+        finally:
+            self.process.wait()
+            self.process.stdout.close()
+
+    def kill(self):
+        # A broken worker is killed and waited for, so it doesn't stay as a zombie.
+        self.process.kill()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except IOError:
+                pass
+        self.process.wait()
+
+
+class JavaWorkerPool(object):
+    """Pool of up to `size` Java workers, so several instances can be solved at the same time."""
+
+    def __init__(self, size=None):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        self.size = size
+        # The workers start when they are needed, so solving a single instance
+        # boots a single JVM.
+        self.started = 0
+        self.lock = threading.Lock()
+        self.idle = Queue()
 
-    tmp_file_name = 'tmp.data'
-    tmp_file = open(tmp_file_name, 'w')
-    tmp_file.write(input_data)
-    tmp_file.close()
+    def acquire(self):
+        with self.lock:
+            start = self.idle.empty() and self.started < self.size
+            if start:
+                self.started += 1
+        # A worker serves one instance at a time; the callers wait for a free one.
+        # None in the queue is the place of a broken worker, to be started again.
+        worker = None if start else self.idle.get()
+        if worker is None:
+            try:
+                worker = JavaWorker()
+            except BaseException:
+                self.idle.put(None)
+                raise
+        return worker
 
-    # Runs the command: java Solver -file=tmp.data
+    def release(self, worker):
+        with self.lock:
+            # If the pool shrank, the extra workers are closed when they come back.
+            if self.started > self.size:
+                self.started -= 1
+                worker.close()
+            else:
+                self.idle.put(worker)
 
-    process = Popen(['java', 'Solver', '-file=' + tmp_file_name], stdout=PIPE)
-    (stdout, stderr) = process.communicate()
+    def resize(self, size):
+        with self.lock:
+            self.size = size
+            while self.started > self.size and not self.idle.empty():
+                self.started -= 1
+                worker = self.idle.get()
+                if worker is not None:
+                    worker.close()
 
-    # removes the temporay file
-    os.remove(tmp_file_name)
+    def solve(self, input_data):
+        worker = self.acquire()
+        try:
+            result = worker.solve(input_data)
+        except BaseException:
+            # Whatever the failure, the worker may be in the middle of a message, so
+            # it is dropped; a new one starts in its place when needed.
+            try:
+                worker.kill()
+            finally:
+                self.idle.put(None)
+            raise
+        self.release(worker)
+        return result
 
-    return stdout.strip()
+    def close(self):
+        with self.lock:
+            while not self.idle.empty():
+                self.started -= 1
+                worker = self.idle.get()
+                if worker is not None:
+                    worker.close()
+
+
+pool = None
+pool_lock = threading.Lock()
+
+def get_pool(size=None):
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = JavaWorkerPool(size)
+            atexit.register(pool.close)
+        elif size is not None and size != pool.size:
+            pool.resize(size)
+    return pool
+
+
+def solve_it(input_data):
+
+    # Sends the inputData to a running worker of: java Solver -worker
+    # (the JVM boots only once, and there is no temporary file to share).
+
+    return get_pool().solve(input_data)
 
 
 import sys
@@ -31,7 +156,6 @@ if __name__ == '__main__':
         file_location = sys.argv[1].strip()
         with open(file_location, 'r') as input_data_file:
             input_data = input_data_file.read()
-        print solve_it(input_data)
+        print(solve_it(input_data))
     else:
         print('This test requires an input file.  Please select one from the data directory. (i.e. python solver.py ./data/ks_4_0)')
-
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class Graph(object):
+    """Undirected graph in CSR form: the neighbours of v are indices[indptr[v]:indptr[v+1]]."""
+
+    def __init__(self, node_count, edges):
+        self.node_count = node_count
+        self.edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        # Every edge is stored in both directions, grouped by its first node.
+        tails = np.concatenate((self.edges[:, 0], self.edges[:, 1]))
+        heads = np.concatenate((self.edges[:, 1], self.edges[:, 0]))
+        self.indices = heads[np.argsort(tails, kind='stable')]
+
+        self.degrees = np.bincount(tails, minlength=node_count)
+        self.indptr = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(self.degrees, out=self.indptr[1:])
+
+    @classmethod
+    def from_numbers(cls, numbers):
+        ''' Returns the graph from all the numbers of an instance '''
+        node_count, edge_count = int(numbers[0]), int(numbers[1])
+        # After the header, the numbers are the pairs of nodes of the edges.
+        return cls(node_count, numbers[2:2 + 2*edge_count])
+
+    @classmethod
+    def parse(cls, input_data):
+        ''' Parses an instance in the gc_* format with a single NumPy tokenizing pass '''
+        return cls.from_numbers(np.fromstring(input_data, dtype=np.int64, sep=' '))
+
+    @classmethod
+    def load(cls, file_location):
+        ''' Reads an instance in the gc_* format straight from the file into NumPy '''
+        return cls.from_numbers(np.fromfile(file_location, dtype=np.int64, sep=' '))
+
+    def __len__(self):
+        return self.node_count
+
+    def __getitem__(self, v):
+        # The neighbours are a view of the indices, nothing is copied.
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    def __iter__(self):
+        return (self[v] for v in range(self.node_count))
@@ -1,15 +1,29 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
+import time
+import heapq
+import numpy as np
 from ortools.sat.python import cp_model
+from graph import Graph
+
+# Seconds for the whole search, and the part of them Tabucol gets before CP-SAT
+TIME_BUDGET = 120.0
+TABUCOL_SHARE = 0.5
+# Tabucol gives up on k colors after these iterations per node without a new best
+TABUCOL_STALL = 50
+# Seconds per edge CP-SAT spends loading and presolving a model past its time
+# limit; building the model in python costs about the same.
+CP_SAT_EDGE_SECONDS = 5e-6
 
 class StoreBestObjectiveSolution(cp_model.CpSolverSolutionCallback):
     """Store best intermediate solution."""
   
-    def __init__(self, variables):
+    def __init__(self, variables, initial=None):
         cp_model.CpSolverSolutionCallback.__init__(self)
         self.__variables = variables['c']
         self.__target = variables['obj']
+        self.__initial = initial
         self.__best_objective = None
         self.__best_solution = None
 
@@ -20,22 +34,25 @@ class StoreBestObjectiveSolution(cp_model.CpSolverSolutionCallback):
 
     def get_best_solution(self):
         if self.__best_objective == None:
+          # If CP-SAT found nothing, the coloring it started from is still valid.
+          if self.__initial is not None:
+            return self.__initial
           return {
             'obj': len(self.__variables),
             'values': range(len(self.__variables))
           }
         else:
           return {
-            'obj': self.Value(self.__target)+1,
+            'obj': self.__best_objective,
             'values': self.__best_solution
           }
 
-def solve(model, variables, max_time=120.0):
+def solve(model, variables, max_time=120.0, initial=None):
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = max_time
-    solution = StoreBestObjectiveSolution(variables)
+    solution = StoreBestObjectiveSolution(variables, initial)
 
-    status = solver.SolveWithSolutionCallback(model, solution)
+    status = solver.Solve(model, solution)
 
     if status == cp_model.OPTIMAL:
         return {
@@ -45,46 +62,214 @@ def solve(model, variables, max_time=120.0):
     else:
         return solution.get_best_solution(), 0
 
-def calculate_grades(edges, n):
-    grade = [0 for v in range(n)]
-    for i,j in edges:
-        grade[i] += 1
-        grade[j] += 1
-    return grade
-
-def calculate_neighborhood(edges, n):
-    neighborhood = [[] for v in range(n)]
-    for i,j in edges:
-        neighborhood[i]+=[j]
-        neighborhood[j]+=[i]
-    return neighborhood
+def calculate_adjacency(G):
+    ''' Returns the neighbourhood of every node as a bitset in a python int '''
+    adjacency = []
+    row = np.zeros(len(G['N']), dtype=bool)
+    for neighbors in G['N()']:
+        row[neighbors] = True
+        adjacency.append(int.from_bytes(np.packbits(row, bitorder='little').tobytes(), 'little'))
+        row[neighbors] = False
+    return adjacency
+
+def bitset_nodes(bitset):
+    ''' Yields the nodes in a bitset '''
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+def bitset_size(bitset):
+    return bin(bitset).count('1')
+
+def dsatur(G):
+    ''' Returns a coloring where the node with the most colored neighbours goes first '''
+    grades = G['g()'].tolist()
+    neighborhood = G['N()']
+    n = len(G['N'])
+
+    colors = [-1 for v in range(n)]
+    # The colors already used in the neighbourhood of each node
+    seen = [set() for v in range(n)]
+
+    # I keep the nodes in a heap by (saturation, grade). When the saturation of a
+    # node grows I push it again, and the outdated entries are skipped.
+    heap = [(0, -grades[v], v) for v in range(n)]
+    heapq.heapify(heap)
+    while heap:
+        saturation, grade, v = heapq.heappop(heap)
+        if colors[v] >= 0 or -saturation != len(seen[v]):
+            continue
+        color = 0
+        while color in seen[v]:
+            color += 1
+        colors[v] = color
+        for u in neighborhood[v].tolist():
+            if colors[u] < 0 and color not in seen[u]:
+                seen[u].add(color)
+                heapq.heappush(heap, (-len(seen[u]), -grades[u], u))
+    return colors
 
 def get_unconnected_nodes(G):
-    return [n for n in G['N'] if G['g()'][n] == 0]
+    return np.flatnonzero(G['g()'] == 0).tolist()
 
 def get_leaves(G):
-    return [n for n in G['N'] if G['g()'][n] == 1]
+    return np.flatnonzero(G['g()'] == 1).tolist()
 
 def could_exist_k_grade_clique(G, k):
-    return len([g for g in G['g()'] if g>=k]) >= k
-
-# TODO: It's not as easy as I thought
-def get_a_k_grade_clique(G, k):
-    if not could_exist_k_grade_clique:
-        return []
-    possibles = [n for n in G['N'] if G['g()'][n] >= k]
-    
-    for i in range(len(possibles)):
-        for n in G['N()'][possibles[i]]:
-            if n not in possibles:
-              pass
-    return []
-
-
-def make_model(G):
+    return np.count_nonzero(G['g()'] >= k) >= k
+
+def grow_clique(adjacency, clique, candidates):
+    ''' Adds to the clique the candidate with more candidate neighbours, while there is one '''
+    clique = list(clique)
+    while candidates:
+        v = max(bitset_nodes(candidates), key=lambda u: bitset_size(adjacency[u] & candidates))
+        clique.append(v)
+        candidates &= adjacency[v]
+    return clique
+
+def improve_clique(G, adjacency, clique, max_steps=100, tenure=7):
+    ''' Swaps a clique node for an outside node joined to all the others, looking for room to grow '''
+    grades = G['g()'].tolist()
+    best = list(clique)
+    clique = set(clique)
+    tabu = {}
+
+    for step in range(max_steps):
+        mask = sum(1 << v for v in clique)
+        swaps = []
+        for u in G['N']:
+            if u in clique or tabu.get(u, -1) >= step:
+                continue
+            missing = mask & ~adjacency[u]
+            if missing & (missing - 1) == 0:
+                swaps.append((grades[u], u, missing))
+        if not swaps:
+            break
+
+        # I swap in the node with the highest grade. The dropped node can't come
+        # back for some steps, so the search doesn't walk in circles.
+        grade, u, missing = max(swaps)
+        for w in bitset_nodes(missing):
+            clique.remove(w)
+            tabu[w] = step + tenure
+        clique.add(u)
+        candidates = adjacency[u]
+        for v in clique:
+            candidates &= adjacency[v]
+        clique = set(grow_clique(adjacency, clique, candidates))
+
+        if len(clique) > len(best):
+            best = list(clique)
+    return best
+
+def get_a_clique(G, starts=10, max_steps=100):
+    ''' Returns a big clique: greedy from the nodes with highest grade plus a local search '''
+    grades = G['g()'].tolist()
+    adjacency = calculate_adjacency(G)
+
+    best = []
+    for v in sorted(G['N'], key=lambda u: -grades[u])[:starts]:
+        # A node with a grade lower than the best size can't improve it
+        if grades[v] < len(best):
+            break
+        clique = grow_clique(adjacency, [v], adjacency[v])
+        clique = improve_clique(G, adjacency, clique, max_steps)
+        if len(clique) > len(best):
+            best = clique
+    return best
+
+def relabel_coloring(coloring, clique):
+    ''' Renames the colors so the k-th node of the clique has the color k '''
+    renaming = {}
+    for k, v in enumerate(clique):
+        renaming[coloring[v]] = k
+    for color in sorted(set(coloring)):
+        if color not in renaming:
+            renaming[color] = len(renaming)
+    return [renaming[color] for color in coloring]
+
+
+def tabucol(G, k, coloring, deadline, seed=0, stall=TABUCOL_STALL):
+    ''' Searches a k-coloring without conflicts starting from the given one; None if it stalls or time runs out '''
+    neighborhood = G['N()']
     edges = G['E']
+    n = len(G['N'])
+    rng = np.random.default_rng(seed)
+    nodes = np.arange(n)
+
+    colors = np.array(coloring, dtype=np.int64)
+    # conflicts[v, c] is the number of neighbours of v with the color c. A move
+    # only changes the rows of the neighbours of the moved node.
+    conflicts = np.zeros((n, k), dtype=np.int64)
+    np.add.at(conflicts, (edges[:, 0], colors[edges[:, 1]]), 1)
+    np.add.at(conflicts, (edges[:, 1], colors[edges[:, 0]]), 1)
+    # tabu[v, c] is the iteration until which v can't go back to the color c
+    tabu = np.zeros((n, k), dtype=np.int64)
+
+    total = int(conflicts[nodes, colors].sum()) // 2
+    best_total = total
+    max_stall = max(stall*n, 1000)
+    best_iteration = 0
+    iteration = 0
+    while total > 0:
+        iteration += 1
+        if iteration - best_iteration > max_stall:
+            return None
+        if time.time() > deadline:
+            return None
+
+        # The moves of a node in conflict to any other color; a tabu move is
+        # only allowed if it leads to a new best.
+        candidates = np.flatnonzero(conflicts[nodes, colors] > 0)
+        current = conflicts[candidates, colors[candidates]]
+        delta = conflicts[candidates] - current[:, None]
+        allowed = (tabu[candidates] < iteration) | (total + delta < best_total)
+        allowed[np.arange(len(candidates)), colors[candidates]] = False
+        if not allowed.any():
+            continue
+        delta = np.where(allowed, delta, n)
+        moves = np.flatnonzero(delta.ravel() == delta.min())
+        i, color = divmod(int(moves[rng.integers(len(moves))]), k)
+        v = candidates[i]
+        old = colors[v]
+
+        neighbors = neighborhood[v]
+        conflicts[neighbors, old] -= 1
+        conflicts[neighbors, color] += 1
+        colors[v] = color
+        total += int(delta[i, color])
+        if total < best_total:
+            best_total = total
+            best_iteration = iteration
+        tabu[v, old] = iteration + int(0.6*len(candidates)) + int(rng.integers(10))
+    return colors.tolist()
+
+def remove_color(G, coloring, k):
+    ''' Moves the nodes with the color k to the color less used by their neighbours '''
+    neighborhood = G['N()']
+    colors = np.array(coloring, dtype=np.int64)
+    for v in np.flatnonzero(colors == k):
+        colors[v] = np.bincount(colors[neighborhood[v]], minlength=k+1)[:k].argmin()
+    return colors.tolist()
+
+def color_with_tabucol(G, coloring, time_limit, lower_bound=1):
+    ''' Removes one color at a time from a coloring while Tabucol repairs it in time '''
+    deadline = time.time() + time_limit
+    best = coloring
+    k = max(coloring)
+    while k >= lower_bound and time.time() < deadline:
+        found = tabucol(G, k, remove_color(G, best, k), deadline)
+        if found is None:
+            break
+        best = found
+        k -= 1
+    return best
+
+def make_model(G, coloring=None, clique=None):
+    edges = G['E'].tolist()
     nodes = G['N']
-    grades = G['g()']
+    grades = G['g()'].tolist()
 
     n = len(nodes)
 
@@ -94,6 +279,9 @@ def make_model(G):
     # Upper bound
     # UPPER = max(grades)-1
     u_bs = [grades[i] for i in nodes]
+    # A known coloring bounds every color by the number of colors it uses.
+    if coloring is not None:
+        u_bs = [min(u_bs[i], max(coloring)) for i in nodes]
     obj_bound = max(u_bs)
 
     # Variables: 
@@ -102,7 +290,9 @@ def make_model(G):
          'c_{}'.format(i)) for i in nodes]
     
     # target is the objective function
-    target = model.NewIntVar(0, obj_bound, 'obj')
+    # A clique needs as many colors as nodes it has.
+    obj_lower_bound = len(clique)-1 if clique else 0
+    target = model.NewIntVar(obj_lower_bound, obj_bound, 'obj')
 
     # Constraints: 
     # c_i != c_j for every ij in E
@@ -111,6 +301,17 @@ def make_model(G):
     
     # target = max(c_i)
     model.AddMaxEquality(target, c)
+
+    # Symmetry breaking: the k-th node of the clique gets the color k
+    if clique:
+        for k, v in enumerate(clique):
+            model.Add(c[v] == k)
+
+    # The search starts from the known coloring.
+    if coloring is not None:
+        for i in nodes:
+            model.AddHint(c[i], coloring[i])
+        model.AddHint(target, max(coloring))
     
 
     # Objective function: minimize max(c)
@@ -124,6 +325,68 @@ def make_model(G):
     return model, {'c': c, 'obj': target}
 
 
+def make_feasibility_model(G, k, coloring=None, clique=None):
+    edges = G['E'].tolist()
+    nodes = G['N']
+    grades = G['g()'].tolist()
+
+    # Model definition: only the question "is there a coloring with k colors?"
+    model = cp_model.CpModel()
+
+    # Variables: 
+    # c_i = j iff the color j is assigned to the node i, with j < k
+    c = [ model.NewIntVar(0, min(grades[i], k-1),
+         'c_{}'.format(i)) for i in nodes]
+
+    # Constraints: 
+    # c_i != c_j for every ij in E
+    for i,j in edges:
+      model.Add(c[i] != c[j])
+
+    # Symmetry breaking: the k-th node of the clique gets the color k
+    if clique:
+        for j, v in enumerate(clique):
+            model.Add(c[v] == j)
+
+    # The search starts from the known coloring, even if it has conflicts.
+    if coloring is not None:
+        for i in nodes:
+            model.AddHint(c[i], coloring[i])
+
+    return model, {'c': c}
+
+def solve_decreasing(G, coloring, clique, time_limit):
+    ''' Asks CP-SAT for a coloring with one color less each time; returns the last one and if it's optimal '''
+    deadline = time.time() + time_limit
+    overhead = len(G['E']) * CP_SAT_EDGE_SECONDS
+    best = coloring
+    k = max(best)
+    # A clique can't take less colors than its nodes.
+    while k >= len(clique):
+        if deadline - time.time() <= 2*overhead:
+            return best, 0
+
+        # The hint is the last coloring with its highest color taken out. Each
+        # question gets all the time left: the easy ones answer early and leave it
+        # to the next, and an unanswered one can't be resumed anyway.
+        model, variables = make_feasibility_model(G, k, remove_color(G, best, k), clique)
+        max_time = deadline - time.time() - overhead
+        if max_time <= 0:
+            return best, 0
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = max_time
+        status = solver.Solve(model)
+
+        if status == cp_model.INFEASIBLE:
+            # There is no coloring with k colors, so the last one is optimal.
+            return best, 1
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return best, 0
+        # CP-SAT may use less than k colors, so the next k comes from its coloring.
+        best = [solver.Value(v) for v in variables['c']]
+        k = max(best)
+    return best, 1
+
 def prepare_return_data(solution, optimal=0):
     # prepare the solution in the specified output format
     output_data = str(int(solution['obj'])) + ' ' + str(optimal) + '\n'
@@ -131,29 +394,59 @@ def prepare_return_data(solution, optimal=0):
     return output_data
 
 
-def solve_it(input_data):
-    # parse the input
-    lines = input_data.split('\n')
+def solve_it(input_data, engine='cp', time_limit=TIME_BUDGET):
+    start = time.time()
 
-    first_line = lines[0].split()
-    node_count = int(first_line[0])
-    edge_count = int(first_line[1])
+    # parse the input
+    graph = Graph.parse(input_data)
 
-    edges = []
-    for i in range(1, edge_count + 1):
-        line = lines[i]
-        parts = line.split()
-        edges.append((int(parts[0]), int(parts[1])))
-    
+    # Every part of the solver shares the CSR arrays of the graph:
+    # 'g()' are the grades and 'N()'[v] is a view of the neighbours of v.
     G = {
-      'N': range(node_count),
-      'E': edges,
-      'g()': calculate_grades(edges, node_count)
-      'N()': calculate_neighborhood(edges, node_count)
+      'N': range(graph.node_count),
+      'E': graph.edges,
+      'g()': graph.degrees,
+      'N()': graph
     }
-    model, variables = make_model(G)
+
+    # DSatur gives a first coloring in no time: it bounds the model and is its hint.
+    # A clique bounds it from below, and if both meet, the coloring is optimal.
+    clique = get_a_clique(G)
+    coloring = dsatur(G)
+
+    # Tabucol takes colors out of the DSatur coloring. Alone it gets all the time
+    # left, otherwise its coloring is where CP-SAT starts from.
+    remaining = time_limit - (time.time() - start)
+    if engine == 'tabucol':
+        coloring = color_with_tabucol(G, coloring, remaining, len(clique))
+    else:
+        coloring = color_with_tabucol(G, coloring, min(time_limit*TABUCOL_SHARE, remaining), len(clique))
+
+    coloring = relabel_coloring(coloring, clique)
+    initial = {'obj': max(coloring)+1, 'values': coloring}
+    if initial['obj'] == len(clique):
+        return prepare_return_data(initial, 1)
+    if engine == 'tabucol':
+        return prepare_return_data(initial, 0)
+
+    # The k-decreasing mode solves feasibility questions instead of minimizing max(c).
+    if engine == 'decreasing':
+        max_time = time_limit - (time.time() - start)
+        coloring, optimal = solve_decreasing(G, coloring, clique, max_time)
+        return prepare_return_data({'obj': max(coloring)+1, 'values': coloring}, optimal)
+
+    # CP-SAT only gets the time left, without what building and loading the model
+    # take, and it isn't run if that is all the time left.
+    overhead = len(graph.edges) * CP_SAT_EDGE_SECONDS
+    if time_limit - (time.time() - start) <= 2*overhead:
+        return prepare_return_data(initial, 0)
+
+    model, variables = make_model(G, coloring, clique)
     
-    solution, optimal = solve(model, variables)
+    max_time = time_limit - (time.time() - start) - overhead
+    if max_time <= 0:
+        return prepare_return_data(initial, 0)
+    solution, optimal = solve(model, variables, max_time, initial=initial)
 
     return prepare_return_data(solution, optimal)
 